@@ -0,0 +1,193 @@
+import base64
+import codecs
+import csv
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from boto3.dynamodb.types import Binary, TypeDeserializer
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, NoCredentialsError
+
+logger = logging.getLogger(__name__)
+
+# Configuración compartida por los clientes de boto3: pool de conexiones amplio para los
+# scans y consultas paralelas y reintentos adaptativos ante throttling de DynamoDB, Athena y Glue
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    tcp_keepalive=True
+)
+
+@functools.lru_cache(maxsize=1)
+def get_session():
+    """Devuelve una única sesión de boto3 por proceso, creada con las credenciales del archivo de configuración."""
+    try:
+        session = boto3.Session(region_name=os.getenv('AWS_REGION', 'us-east-1'))
+        # Resolver la cadena de credenciales una sola vez al crear la sesión
+        session.get_credentials()
+        return session
+    except (BotoCoreError, NoCredentialsError) as e:
+        logger.error(f"Error al crear la sesión de boto3: {e}")
+        raise
+
+def get_dynamodb_tables():
+    """Devuelve la lista de tablas DynamoDB a ingerir, definida en DYNAMODB_TABLES_DEV separadas por comas."""
+    return [table.strip() for table in os.getenv('DYNAMODB_TABLES_DEV', '').split(',') if table.strip()]
+
+def scan_dynamodb_table(dynamodb_client, table_name, total_segments=8, max_pending_pages=16):
+    """Realiza un scan paralelo de una tabla DynamoDB, un hilo por segmento, y devuelve sus elementos en streaming."""
+    # El cliente de bajo nivel es thread-safe y se comparte entre los segmentos; un único
+    # TypeDeserializer convierte los diccionarios {tipo: valor} a tipos nativos de Python
+    paginator = dynamodb_client.get_paginator('scan')
+    deserializer = TypeDeserializer()
+
+    # Los segmentos publican sus páginas en una cola acotada: en memoria solo hay unas pocas
+    # páginas a la vez en lugar de la tabla completa
+    pages = queue.Queue(maxsize=max_pending_pages)
+    stop = threading.Event()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                pages.put(value, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def scan_segment(segment):
+        response_iterator = paginator.paginate(
+            TableName=table_name,
+            Segment=segment,
+            TotalSegments=total_segments
+        )
+        try:
+            for page in response_iterator:
+                if stop.is_set():
+                    break
+                put([
+                    {key: deserializer.deserialize(value) for key, value in item.items()}
+                    for item in page['Items']
+                ])
+            put(None)  # Fin del segmento
+        except Exception as e:
+            put(e)
+
+    executor = ThreadPoolExecutor(max_workers=total_segments)
+    for segment in range(total_segments):
+        executor.submit(scan_segment, segment)
+    try:
+        finished = 0
+        while finished < total_segments:
+            page = pages.get()
+            if page is None:
+                finished += 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        # Detener los segmentos pendientes si el consumidor termina antes o hubo un error
+        stop.set()
+        executor.shutdown(wait=True)
+
+def to_serializable(value):
+    """Convierte a tipos de JSON los valores de DynamoDB que json no sabe serializar."""
+    if isinstance(value, Decimal):
+        # Los números de DynamoDB tienen hasta 38 dígitos: los no enteros se escriben como texto
+        # exacto en lugar de pasar por float y perder precisión
+        return int(value) if value == value.to_integral_value() else str(value)
+    if isinstance(value, Binary):
+        value = value.value
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+    if isinstance(value, (set, frozenset)):
+        # Los sets de DynamoDB son homogéneos: ordenarlos da una salida estable
+        # (se ordenan antes de convertir, ya que un NS mezcla enteros y textos al serializarse)
+        elements = sorted(value, key=lambda element: element.value if isinstance(element, Binary) else element)
+        return [to_serializable(element) if not isinstance(element, str) else element for element in elements]
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+def to_text(value):
+    """Convierte un valor de DynamoDB a texto plano para CSV; listas, sets y mapas se escriben como JSON."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (Decimal, Binary, bytes, bytearray)):
+        return str(to_serializable(value))
+    return json.dumps(value, default=to_serializable)
+
+def has_empty_struct(arrow_type):
+    """Indica si un tipo de Arrow contiene, a cualquier profundidad, un struct sin campos."""
+    if pa.types.is_struct(arrow_type):
+        return arrow_type.num_fields == 0 or any(has_empty_struct(field.type) for field in arrow_type)
+    if pa.types.is_map(arrow_type):
+        return has_empty_struct(arrow_type.key_type) or has_empty_struct(arrow_type.item_type)
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type) or pa.types.is_fixed_size_list(arrow_type):
+        return has_empty_struct(arrow_type.value_type)
+    return False
+
+def to_arrow_table(items, fieldnames):
+    """Construye una tabla de Arrow columna a columna a partir de los elementos de DynamoDB."""
+    columns = {}
+    for name in fieldnames:
+        values = [item.get(name) for item in items]
+        try:
+            column = pa.array(values)
+            # Los mapas vacíos se infieren como struct sin campos, que Parquet no puede escribir
+            if has_empty_struct(column.type):
+                raise pa.ArrowInvalid(f"La columna {name} contiene un struct sin campos")
+            columns[name] = column
+        except pa.ArrowException:
+            # DynamoDB no impone esquema: tipos mezclados, sets, binarios, mapas vacíos o números
+            # fuera del rango de decimal128 se escriben como texto en lugar de abortar la ingesta
+            columns[name] = pa.array([to_text(value) for value in values], type=pa.string())
+    return pa.table(columns)
+
+def get_key_attributes(dynamodb_client, table_name):
+    """Devuelve los atributos de la clave primaria de una tabla DynamoDB (partición y, si existe, ordenación)."""
+    key_schema = dynamodb_client.describe_table(TableName=table_name)['Table']['KeySchema']
+    # La clave de partición (HASH) va antes que la de ordenación (RANGE)
+    return [key['AttributeName'] for key in sorted(key_schema, key=lambda key: key['KeyType'] != 'HASH')]
+
+def write_items(items, data, file_format, key_attributes=()):
+    """Serializa los elementos en el archivo indicado y devuelve la extensión del formato usado."""
+    if file_format in ('parquet', 'csv'):
+        # Los formatos tabulares necesitan el esquema completo antes de escribir
+        items = list(items)
+        # Los elementos llegan en el orden en que terminan los segmentos: para que el esquema
+        # sea estable entre ejecuciones, la clave primaria va primero y el resto en orden alfabético
+        columns = {key for item in items for key in item}
+        fieldnames = [key for key in key_attributes if key in columns]
+        fieldnames += sorted(columns.difference(fieldnames))
+        if file_format == 'parquet':
+            # Parquet con compresión Snappy: menos bytes en S3 y lectura columnar en Athena
+            pq.write_table(to_arrow_table(items, fieldnames), data, compression='snappy')
+            return 'parquet'
+        try:
+            # Serializar con el escritor CSV de Arrow, en C++ y columna a columna
+            pa_csv.write_csv(to_arrow_table(items, fieldnames), data)
+        except pa.ArrowException:
+            # Arrow no escribe listas ni mapas en CSV: usar csv.DictWriter en ese caso
+            data.seek(0)
+            data.truncate()
+            writer = csv.DictWriter(codecs.getwriter('utf-8')(data), fieldnames=fieldnames, lineterminator='\n')
+            writer.writeheader()
+            writer.writerows({key: to_text(value) for key, value in item.items()} for item in items)
+        return 'csv'
+
+    # JSON se escribe en streaming, elemento a elemento, sin acumular la tabla en memoria
+    writer = codecs.getwriter('utf-8')(data)
+    writer.write('[')
+    for index, item in enumerate(items):
+        writer.write(',\n' if index else '\n')
+        writer.write(json.dumps(item, indent=4, default=to_serializable))
+    writer.write('\n]\n')
+    return 'json'
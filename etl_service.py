@@ -1,10 +1,12 @@
 import time
-import boto3
-import pandas as pd
-from botocore.exceptions import BotoCoreError, NoCredentialsError
 from dotenv import load_dotenv
+from aws_utils import BOTO_CONFIG, get_dynamodb_tables, get_session
 import logging
 import os
+import csv
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 import mysql.connector
 
 # Configurar el logging
@@ -14,35 +16,37 @@ logger = logging.getLogger(__name__)
 # Cargar las variables de entorno desde el archivo .env
 load_dotenv()
 
-def create_boto3_session():
-    """Crea una sesión de boto3 usando las credenciales especificadas en el archivo de configuración."""
-    try:
-        session = boto3.Session(region_name=os.getenv('AWS_REGION', 'us-east-1'))
-        return session
-    except (BotoCoreError, NoCredentialsError) as e:
-        logger.error(f"Error al crear la sesión de boto3: {e}")
-        raise
-
-def wait_for_catalogs(glue_client, databases, retries=5, delay=10):
-    """Espera a que los catálogos de datos estén disponibles en AWS Glue."""
-    for _ in range(retries):
-        all_available = True
-        for database in databases:
-            try:
-                response = glue_client.get_database(Name=database)
-                logger.info(f"Catálogo de datos {database} está disponible.")
-            except glue_client.exceptions.EntityNotFoundException:
-                logger.info(f"Esperando a que el catálogo de datos {database} esté disponible...")
-                all_available = False
-                break
-        if all_available:
+def wait_for_catalogs(glue_client, databases, timeout=60, initial_delay=2, max_delay=10, backoff=2):
+    """Espera a que los catálogos de datos estén disponibles en AWS Glue, con backoff exponencial."""
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    paginator = glue_client.get_paginator('get_databases')
+    while True:
+        # Glue no ofrece BatchGetDatabases: un único listado del catálogo comprueba todas las
+        # bases de datos a la vez en lugar de una llamada a get_database por cada una
+        existing = {
+            database['Name'].lower()
+            for page in paginator.paginate()
+            for database in page['DatabaseList']
+        }
+        missing = [database for database in databases if database.lower() not in existing]
+        if not missing:
+            logger.info(f"Catálogos de datos disponibles: {', '.join(databases)}.")
             return True
+        logger.info(f"Esperando a que los catálogos de datos estén disponibles: {', '.join(missing)}...")
+        if time.monotonic() + delay > deadline:
+            break
         time.sleep(delay)
+        delay = min(delay * backoff, max_delay)
     raise Exception("Los catálogos de datos no están disponibles después de varios intentos.")
 
-def wait_for_crawler(glue_client, crawler_name, retries=20, delay=60):
-    """Espera a que el crawler de AWS Glue complete su ejecución."""
-    for _ in range(retries):
+def wait_for_crawler(glue_client, crawler_name, timeout=1200, initial_delay=2, max_delay=30, backoff=2):
+    """Espera a que el crawler de AWS Glue complete su ejecución, con backoff exponencial."""
+    # Glue no ofrece un waiter para crawlers: empezar con intervalos cortos para no pagar
+    # un minuto completo de latencia en crawlers rápidos
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
         try:
             response = glue_client.get_crawler(Name=crawler_name)
             state = response['Crawler']['State']
@@ -54,37 +58,40 @@ def wait_for_crawler(glue_client, crawler_name, retries=20, delay=60):
             return False
         except Exception as e:
             logger.error(f"Error al obtener el estado del crawler {crawler_name}: {e}")
+        if time.monotonic() + delay > deadline:
+            break
         time.sleep(delay)
+        delay = min(delay * backoff, max_delay)
     raise Exception(f"El crawler {crawler_name} no completó su ejecución después de varios intentos.")
 
-def query_athena(session, query, database, output_location):
-    athena = session.client('athena')
+def query_athena(athena_client, query, database, output_location, initial_delay=0.2, max_delay=5, backoff=2):
+    """Ejecuta una consulta en Athena y devuelve la ruta en S3 del CSV de resultados."""
     try:
-        response = athena.start_query_execution(
+        response = athena_client.start_query_execution(
             QueryString=query,
             QueryExecutionContext={'Database': database},
             ResultConfiguration={'OutputLocation': output_location}
         )
         query_execution_id = response['QueryExecutionId']
         
-        # Esperar a que la consulta se complete
+        # Esperar a que la consulta se complete con backoff exponencial: las consultas
+        # cortas responden en menos de un segundo y las largas no saturan la API
+        delay = initial_delay
         while True:
-            result = athena.get_query_execution(QueryExecutionId=query_execution_id)
+            result = athena_client.get_query_execution(QueryExecutionId=query_execution_id)
             status = result['QueryExecution']['Status']['State']
-            logger.info(f"Estado de la consulta en Athena: {status}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Estado de la consulta en Athena: {status}")
             if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
                 break
-            time.sleep(5)
+            time.sleep(delay)
+            delay = min(delay * backoff, max_delay)
         
+        logger.info(f"Estado de la consulta en Athena: {status}")
         if status == 'SUCCEEDED':
-            result = athena.get_query_results(QueryExecutionId=query_execution_id)
-            rows = result['ResultSet']['Rows']
-            columns = [col['Label'] for col in result['ResultSet']['ResultSetMetadata']['ColumnInfo']]
-            logger.info(f"Esquema de la tabla en Athena: {columns}")  # Agregar log para verificar el esquema de la tabla
-            data = [[col.get('VarCharValue', None) for col in row['Data']] for row in rows[1:]]
-            df = pd.DataFrame(data, columns=columns)
-            logger.info(f"DataFrame obtenido de Athena:\n{df.head()}")  # Agregar log para verificar el contenido del DataFrame
-            return df
+            # Athena ya escribió los resultados como CSV en S3: se usan directamente en lugar
+            # de paginar get_query_results (que devuelve como máximo 1000 filas por llamada)
+            return result['QueryExecution']['ResultConfiguration']['OutputLocation']
         else:
             reason = result['QueryExecution']['Status'].get('StateChangeReason', 'Unknown reason')
             logger.error(f"Query failed with status: {status}, reason: {reason}")
@@ -93,73 +100,148 @@ def query_athena(session, query, database, output_location):
         logger.error(f"Error al ejecutar la consulta en Athena: {e}")
         raise
 
-def save_to_mysql(df, table_name):
+def download_query_results(s3_client, result_location):
+    """Descarga en streaming el CSV de resultados de Athena a un archivo temporal y devuelve su ruta."""
+    bucket, key = result_location.replace('s3://', '', 1).split('/', 1)
+    with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as tmp:
+        try:
+            s3_client.download_fileobj(bucket, key, tmp)
+        except Exception:
+            # No dejar archivos temporales a medio descargar en disco
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    return tmp.name
+
+def load_data_infile(cursor, csv_path, columns, table_name):
+    """Carga el CSV de resultados de Athena en MySQL con LOAD DATA LOCAL INFILE."""
+    # Athena entrecomilla todos los valores y deja vacíos los nulos: sin carácter de escape
+    # los valores se leen literalmente y NULLIF convierte los campos vacíos en NULL
+    variables = [f'@c{i}' for i in range(len(columns))]
+    assignments = ', '.join(f"`{col}` = NULLIF({var}, '')" for col, var in zip(columns, variables))
+    cursor.execute(
+        f"LOAD DATA LOCAL INFILE '{csv_path}' INTO TABLE `{table_name}` "
+        "CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+        "LINES TERMINATED BY '\\n' "
+        "IGNORE 1 LINES "
+        f"({', '.join(variables)}) SET {assignments}"
+    )
+    return cursor.rowcount
+
+def insert_rows(cursor, csv_path, columns, table_name, batch_size=10000):
+    """Inserta el CSV de resultados de Athena en MySQL en lotes de INSERT multi-fila."""
+    # executemany reescribe cada lote como un único INSERT multi-fila, evitando un round trip por fila
+    # Columnas explícitas: la tabla puede existir con otro orden, igual que en LOAD DATA se asignan por nombre
+    column_names = ', '.join(f'`{col}`' for col in columns)
+    placeholders = ', '.join(['%s'] * len(columns))
+    insert_query = f'INSERT INTO `{table_name}` ({column_names}) VALUES ({placeholders})'
+    total = 0
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)  # Omitir la cabecera
+        rows = ([value or None for value in row] for row in reader)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            cursor.executemany(insert_query, batch)
+            total += len(batch)
+    return total
+
+def save_to_mysql(csv_path, table_name, batch_size=10000):
     try:
+        # Leer solo la cabecera para conocer el esquema; las filas se cargan en streaming
+        with open(csv_path, newline='', encoding='utf-8') as f:
+            columns = next(csv.reader(f))
+        logger.info(f"Esquema de la tabla en Athena: {columns}")  # Agregar log para verificar el esquema de la tabla
+        
         conn = mysql.connector.connect(
             host='mysql',
             user=os.getenv('MYSQL_USER'),
             password=os.getenv('MYSQL_PASSWORD'),
-            database=os.getenv('MYSQL_DATABASE')
+            database=os.getenv('MYSQL_DATABASE'),
+            allow_local_infile=True,
+            autocommit=False,
+            use_pure=False  # Usar la extensión en C del conector, más rápida en cargas masivas
         )
         cursor = conn.cursor()
         
         # Crear la tabla si no existe
-        columns = ', '.join([f'`{col}` TEXT' for col in df.columns])
-        create_table_query = f'CREATE TABLE IF NOT EXISTS `{table_name}` ({columns})'
-        logger.info(f"Creando tabla con la consulta: {create_table_query}")
+        columns_definition = ', '.join([f'`{col}` TEXT' for col in columns])
+        create_table_query = f'CREATE TABLE IF NOT EXISTS `{table_name}` ({columns_definition})'
+        logger.info(f"Creando tabla {table_name} si no existe...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Creando tabla con la consulta: {create_table_query}")
         cursor.execute(create_table_query)
         
-        # Insertar los datos
-        for _, row in df.iterrows():
-            values = ', '.join([f"'{val}'" for val in row])
-            insert_query = f'INSERT INTO `{table_name}` VALUES ({values})'
-            logger.info(f"Insertando datos con la consulta: {insert_query}")
-            cursor.execute(insert_query)
+        # Cargar los datos con LOAD DATA; si el servidor no lo permite, usar INSERT por lotes
+        try:
+            total = load_data_infile(cursor, csv_path, columns, table_name)
+        except mysql.connector.Error as err:
+            logger.warning(f"LOAD DATA LOCAL INFILE no disponible ({err}), usando INSERT por lotes...")
+            total = insert_rows(cursor, csv_path, columns, table_name, batch_size)
         
+        # Una sola transacción para toda la carga
         conn.commit()
         cursor.close()
         conn.close()
-        logger.info(f"Datos guardados en MySQL, tabla: {table_name}.")
+        logger.info(f"Datos guardados en MySQL, tabla: {table_name} ({total} filas).")
     except mysql.connector.Error as err:
         logger.error(f"Error al guardar datos en MySQL: {err}")
 
+def process_database(glue_client, athena_client, s3_client, glue_database, glue_table, crawler_name, output_location):
+    """Consulta en Athena la tabla de una base de datos Glue y guarda el resultado en MySQL."""
+    # Esperar a que el crawler complete su ejecución
+    if not wait_for_crawler(glue_client, crawler_name):
+        return
+    
+    query = f"SELECT * FROM {glue_table}"  # Usar el nombre de la tabla derivado del archivo CSV
+    logger.info(f"Ejecutando consulta en Athena para la base de datos: {glue_database}...")
+    result_location = query_athena(athena_client, query, glue_database, output_location)
+    csv_path = download_query_results(s3_client, result_location)
+    try:
+        table_name = f"summary_table_{glue_table}"  # Generar un nombre de tabla único
+        logger.info(f"Guardando resultados en MySQL, tabla: {table_name}...")
+        save_to_mysql(csv_path, table_name)
+    finally:
+        os.remove(csv_path)
+
 def main():
     logger.info("Iniciando sesión de boto3...")
-    session = create_boto3_session()
-    glue_client = session.client('glue')
+    session = get_session()
+    # Crear los clientes una sola vez: son thread-safe y se comparten entre los hilos
+    glue_client = session.client('glue', config=BOTO_CONFIG)
+    athena_client = session.client('athena', config=BOTO_CONFIG)
+    s3_client = session.client('s3', config=BOTO_CONFIG)
     s3_bucket = os.getenv('S3_BUCKET_DEV')
     output_location = f"s3://{s3_bucket}/athena-results/"
     
-    # Construir la lista de bases de datos Glue utilizando las variables de entorno
-    ingest_services = [
-        'ingest-service-1',
-        'ingest-service-2',
-        'ingest-service-3',
-        'ingest-service-4',
-        'ingest-service-5'
-    ]
+    # Construir los nombres de Glue a partir de la lista de tablas, igual que los servicios de ingesta
+    dynamodb_tables = get_dynamodb_tables()
+    if not dynamodb_tables:
+        logger.error("Error: DYNAMODB_TABLES_DEV es obligatorio.")
+        return
+    ingest_services = [f'ingest-service-{index}' for index in range(1, len(dynamodb_tables) + 1)]
     
-    glue_databases = [f"glue_database_{service}_dev-usuarios_dev" for service in ingest_services]
+    glue_databases = [f"glue_database_{service}_{table}_dev" for service, table in zip(ingest_services, dynamodb_tables)]
     glue_tables = [f"{service.replace('-', '_')}" for service in ingest_services]  # Derivar el nombre de la tabla de Glue
+    crawler_names = [f"crawler_{service}_{table}_dev" for service, table in zip(ingest_services, dynamodb_tables)]
     
     # Esperar a que los catálogos de datos estén disponibles
     wait_for_catalogs(glue_client, glue_databases)
 
-    for glue_database, glue_table in zip(glue_databases, glue_tables):
-        # Esperar a que el crawler complete su ejecución
-        crawler_name = f"crawler_{glue_table.replace('_', '-')}_dev-usuarios_dev"
-        if not wait_for_crawler(glue_client, crawler_name):
-            continue
-        
-        query = f"SELECT * FROM {glue_table}"  # Usar el nombre de la tabla derivado del archivo CSV
-        logger.info(f"Ejecutando consulta en Athena para la base de datos: {glue_database}...")
-        try:
-            df = query_athena(session, query, glue_database, output_location)
-            table_name = f"summary_table_{glue_table}"  # Generar un nombre de tabla único
-            logger.info(f"Guardando resultados en MySQL, tabla: {table_name}...")
-            save_to_mysql(df, table_name)
-        except Exception as e:
-            logger.error(f"Error al procesar la base de datos {glue_database}: {e}")
+    # Las consultas de cada base de datos son independientes: ejecutarlas en paralelo
+    with ThreadPoolExecutor(max_workers=len(glue_databases)) as executor:
+        futures = {
+            executor.submit(process_database, glue_client, athena_client, s3_client, glue_database, glue_table, crawler_name, output_location): glue_database
+            for glue_database, glue_table, crawler_name in zip(glue_databases, glue_tables, crawler_names)
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error al procesar la base de datos {futures[future]}: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,10 @@
-import boto3
-import pandas as pd
-import json
 import os
 import logging
-from botocore.config import Config
-from botocore.exceptions import BotoCoreError, NoCredentialsError, ClientError
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
+from aws_utils import BOTO_CONFIG, get_dynamodb_tables, get_key_attributes, get_session, scan_dynamodb_table, write_items
 import time
+import tempfile
 
 # Configurar el logging
 logging.basicConfig(
@@ -24,48 +22,14 @@ logger = logging.getLogger(__name__)
 # Cargar las variables de entorno desde el archivo .env
 load_dotenv()
 
-def create_boto3_session():
-    """Crea una sesión de boto3 usando las credenciales especificadas en el archivo de configuración."""
-    try:
-        session = boto3.Session(region_name=os.getenv('AWS_REGION', 'us-east-1'))
-        return session
-    except (BotoCoreError, NoCredentialsError) as e:
-        logger.error(f"Error al crear la sesión de boto3: {e}")
-        raise
-
-def scan_dynamodb_table(session, table_name):
-    """Realiza un scan de una tabla DynamoDB con paginación."""
-    dynamodb = session.client('dynamodb')
-    paginator = dynamodb.get_paginator('scan')
-    response_iterator = paginator.paginate(TableName=table_name)
-    
-    items = []
-    for page in response_iterator:
-        items.extend(page['Items'])
-    
-    return items
-
-def transform_items(items):
-    """Transforma los elementos de DynamoDB a un formato plano adecuado para CSV."""
-    transformed_items = []
-    for item in items:
-        transformed_item = {}
-        for key, value in item.items():
-            for data_type, data_value in value.items():
-                transformed_item[key] = data_value
-        transformed_items.append(transformed_item)
-    return transformed_items
+def save_to_s3(s3_client, data, bucket_name, file_name):
+    """Guarda los datos de un archivo en un bucket S3 en streaming, con multipart upload para archivos grandes."""
+    s3_client.upload_fileobj(data, bucket_name, file_name)
 
-def save_to_s3(session, data, bucket_name, file_name):
-    """Guarda los datos en un bucket S3."""
-    s3 = session.client('s3')
-    s3.put_object(Bucket=bucket_name, Key=file_name, Body=data)
-
-def create_glue_crawler(session, crawler_name, s3_target, role, database_name):
+def create_glue_crawler(glue_client, crawler_name, s3_target, role, database_name):
     """Crea un crawler de AWS Glue."""
-    glue = session.client('glue')
     try:
-        glue.create_crawler(
+        glue_client.create_crawler(
             Name=crawler_name,
             Role=role,
             DatabaseName=database_name,
@@ -76,25 +40,28 @@ def create_glue_crawler(session, crawler_name, s3_target, role, database_name):
             }
         )
         logger.info(f"Crawler {crawler_name} creado exitosamente.")
-    except glue.exceptions.AlreadyExistsException:
+    except glue_client.exceptions.AlreadyExistsException:
         logger.warning(f"Crawler {crawler_name} ya existe.")
 
-def start_glue_crawler(session, crawler_name):
+def start_glue_crawler(glue_client, crawler_name):
     """Inicia un crawler de AWS Glue."""
-    glue = session.client('glue')
     try:
-        glue.start_crawler(Name=crawler_name)
+        glue_client.start_crawler(Name=crawler_name)
         logger.info(f"Crawler {crawler_name} iniciado.")
-    except glue.exceptions.CrawlerRunningException:
+    except glue_client.exceptions.CrawlerRunningException:
         logger.warning(f"Crawler {crawler_name} ya está en ejecución.")
-    except glue.exceptions.CrawlerNotFoundException:
+    except glue_client.exceptions.CrawlerNotFoundException:
         logger.error(f"Crawler {crawler_name} no encontrado.")
     except Exception as e:
         logger.error(f"Error al iniciar el crawler {crawler_name}: {e}")
 
-def wait_for_crawler(glue_client, crawler_name, retries=20, delay=60):
-    """Espera a que el crawler de AWS Glue complete su ejecución."""
-    for _ in range(retries):
+def wait_for_crawler(glue_client, crawler_name, timeout=1200, initial_delay=2, max_delay=30, backoff=2):
+    """Espera a que el crawler de AWS Glue complete su ejecución, con backoff exponencial."""
+    # Glue no ofrece un waiter para crawlers: empezar con intervalos cortos para no pagar
+    # un minuto completo de latencia en crawlers rápidos
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
         try:
             response = glue_client.get_crawler(Name=crawler_name)
             state = response['Crawler']['State']
@@ -103,69 +70,75 @@ def wait_for_crawler(glue_client, crawler_name, retries=20, delay=60):
                 return True
         except Exception as e:
             logger.error(f"Error al obtener el estado del crawler {crawler_name}: {e}")
+        if time.monotonic() + delay > deadline:
+            break
         time.sleep(delay)
+        delay = min(delay * backoff, max_delay)
     raise Exception(f"El crawler {crawler_name} no completó su ejecución después de varios intentos.")
 
 def main():
     # Variables de entorno para la configuración
-    table_name = os.getenv('DYNAMODB_TABLE_1_DEV')
+    dynamodb_tables = get_dynamodb_tables()
+    table_name = dynamodb_tables[0] if len(dynamodb_tables) >= 1 else None
     bucket_name = os.getenv('S3_BUCKET_DEV')
-    file_format = os.getenv('FILE_FORMAT', 'csv')
+    file_format = os.getenv('FILE_FORMAT', 'parquet')
     role = os.getenv('AWS_ROLE_ARN')
     ingest_type = 'ingest-service-1'
     glue_database = f"glue_database_{ingest_type}_{table_name}_dev"
     glue_crawler_name = f"crawler_{ingest_type}_{table_name}_dev"
     
     if not table_name or not bucket_name:
-        logger.error("Error: DYNAMODB_TABLE_1_DEV y S3_BUCKET_DEV son obligatorios.")
+        logger.error("Error: DYNAMODB_TABLES_DEV (tabla 1) y S3_BUCKET_DEV son obligatorios.")
         return
 
     logger.info("Iniciando sesión de boto3...")
-    session = create_boto3_session()
-    
-    try:
-        logger.info(f"Escaneando la tabla DynamoDB: {table_name}...")
-        items = scan_dynamodb_table(session, table_name)
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'ExpiredTokenException':
-            logger.error("El token de seguridad ha expirado. Por favor, renueva las credenciales de AWS.")
-            return
-        else:
-            logger.error(f"Error al escanear la tabla DynamoDB: {e}")
-            return
+    session = get_session()
+    # Crear los clientes una sola vez y reutilizarlos en todas las llamadas
+    dynamodb_client = session.client('dynamodb', config=BOTO_CONFIG)
+    s3_client = session.client('s3', config=BOTO_CONFIG)
+    glue_client = session.client('glue', config=BOTO_CONFIG)
     
-    logger.info("Transformando los elementos de DynamoDB...")
-    transformed_items = transform_items(items)
-    
-    if file_format == 'csv':
-        df = pd.DataFrame(transformed_items)
-        data = df.to_csv(index=False)
-        file_name = f'{ingest_type}/{table_name}.csv'  # Guardar en una carpeta específica
-    else:
-        data = json.dumps(transformed_items, indent=4)
-        file_name = f'{ingest_type}/{table_name}.json'  # Guardar en una carpeta específica
+    # Serializar a un archivo temporal en disco en lugar de un string en memoria
+    with tempfile.TemporaryFile() as data:
+        try:
+            logger.info(f"Escaneando la tabla DynamoDB: {table_name}...")
+            key_attributes = get_key_attributes(dynamodb_client, table_name)
+            extension = write_items(scan_dynamodb_table(dynamodb_client, table_name), data, file_format, key_attributes)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ExpiredTokenException':
+                logger.error("El token de seguridad ha expirado. Por favor, renueva las credenciales de AWS.")
+                return
+            else:
+                logger.error(f"Error al escanear la tabla DynamoDB: {e}")
+                return
+        file_name = f'{ingest_type}/{table_name}.{extension}'  # Guardar en una carpeta específica
+        data.seek(0)
+        
+        logger.info(f"Guardando datos en el bucket S3: {bucket_name}...")
+        save_to_s3(s3_client, data, bucket_name, file_name)
     
-    logger.info(f"Guardando datos en el bucket S3: {bucket_name}...")
-    save_to_s3(session, data, bucket_name, file_name)
+    # Eliminar archivos de otros formatos de ejecuciones anteriores para que el crawler no mezcle esquemas
+    for other_extension in ('parquet', 'csv', 'json'):
+        if other_extension != extension:
+            s3_client.delete_object(Bucket=bucket_name, Key=f'{ingest_type}/{table_name}.{other_extension}')
     
     logger.info(f"Ingesta de datos completada. Archivo subido a S3: {file_name}")
-    logger.info(f"Ruta completa del archivo CSV: s3://{bucket_name}/{file_name}")
+    logger.info(f"Ruta completa del archivo: s3://{bucket_name}/{file_name}")
     
     # Crear y ejecutar el crawler de AWS Glue
     s3_target = f"s3://{bucket_name}/{ingest_type}/"  # Apuntar a la carpeta específica
-    create_glue_crawler(session, glue_crawler_name, s3_target, role, glue_database)
-    start_glue_crawler(session, glue_crawler_name)
+    create_glue_crawler(glue_client, glue_crawler_name, s3_target, role, glue_database)
+    start_glue_crawler(glue_client, glue_crawler_name)
     
     # Esperar a que el crawler complete su ejecución
-    glue_client = session.client('glue')
     wait_for_crawler(glue_client, glue_crawler_name)
 
     # Eliminar la tabla existente para forzar la reconstrucción del esquema
     try:
-        glue_client.delete_table(DatabaseName=glue_database, Name=f"{ingest_type}_{table_name}_csv")
-        logger.info(f"Tabla {ingest_type}_{table_name}_csv eliminada para forzar la reconstrucción del esquema.")
+        glue_client.delete_table(DatabaseName=glue_database, Name=f"{ingest_type}_{table_name}_{extension}")
+        logger.info(f"Tabla {ingest_type}_{table_name}_{extension} eliminada para forzar la reconstrucción del esquema.")
     except glue_client.exceptions.EntityNotFoundException:
-        logger.info(f"La tabla {ingest_type}_{table_name}_csv no existe, no es necesario eliminarla.")
+        logger.info(f"La tabla {ingest_type}_{table_name}_{extension} no existe, no es necesario eliminarla.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file